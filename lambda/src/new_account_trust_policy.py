@@ -2,13 +2,24 @@
 """Respond to new account events by updating trust policy in the account."""
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
 import json
 import os
+import random
 import sys
+import threading
 
 from aws_lambda_powertools import Logger
 from aws_assume_role_lib import assume_role, generate_lambda_session_name
 import boto3
+import botocore.config
+import botocore.session
+
+try:
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+except ImportError:  # Not running in a Lambda runtime that supports SnapStart.
+    register_after_restore = register_before_snapshot = None
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
 
@@ -22,10 +33,38 @@ LOG = Logger(
 )
 
 
+# Parent session for every client this module creates.  Built once per
+# execution environment and rebuilt after a SnapStart restore, so that
+# credentials resolved before the snapshot are never reused.
+BOTOCORE_SESSION = None
+SESSION = None
+
+# Client settings shared by every client this module creates, see
+# new_client_config() for the environment variables that tune them.
+CLIENT_CONFIG = None
+
+# botocore sessions are not thread-safe, so creating sessions and clients
+# from the shared session is serialized while rolling back many accounts.
+SESSION_LOCK = threading.RLock()
+
+
 class TrustPolicyInvalidArgumentsError(Exception):
     """Account creation failed."""
 
 
+class TrustPolicyRollbackError(Exception):
+    """Restoring a trust policy snapshot failed in one or more accounts."""
+
+
+class ThreadSafeSession(botocore.session.Session):
+    """botocore session whose clients can be created from many threads."""
+
+    def create_client(self, *client_args, **client_kwargs):
+        """Create a client while holding the session lock."""
+        with SESSION_LOCK:
+            return super().create_client(*client_args, **client_kwargs)
+
+
 # ---------------------------------------------------------------------
 # Logic specific to handling the event provided to the Lambda handler.
 
@@ -50,10 +89,27 @@ def get_invite_account_id(event):
     return event["detail"]["requestParameters"]["target"]["id"]
 
 
+def get_accept_handshake_account_id(event):
+    """Return account id for accepted invitation handshake events."""
+    # The invited account calls AcceptHandshake, so it records the event.
+    # Invitations sent to an email address have no ACCOUNT party.
+    if event["detail"].get("recipientAccountId"):
+        return event["detail"]["recipientAccountId"]
+
+    parties = event["detail"]["responseElements"]["handshake"]["parties"]
+    account_id = next(
+        (party["id"] for party in parties if party["type"] == "ACCOUNT"), None
+    )
+    if not account_id:
+        raise KeyError(f"No ACCOUNT party in handshake parties: {parties}")
+    return account_id
+
+
 def get_account_id(event):
     """Return account id for supported events."""
     event_name = event["detail"]["eventName"]
     get_account_id_strategy = {
+        "AcceptHandshake": get_accept_handshake_account_id,
         "CreateAccountResult": get_new_account_id,
         "InviteAccountToOrganization": get_invite_account_id,
     }
@@ -63,17 +119,67 @@ def get_account_id(event):
 
 def get_partition():
     """Return AWS partition."""
-    sts = boto3.client("sts")
+    sts = get_client(get_base_session(), "sts")
     return sts.get_caller_identity()["Arn"].split(":")[1]
 
 
 # ---------------------------------------------------------------------
 
 
+def new_client_config():
+    """Replace the shared botocore config used to create clients."""
+    global CLIENT_CONFIG  # pylint: disable=global-statement
+    CLIENT_CONFIG = botocore.config.Config(
+        connect_timeout=float(os.environ.get("BOTO_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(os.environ.get("BOTO_READ_TIMEOUT", 30)),
+        max_pool_connections=int(os.environ.get("BOTO_MAX_POOL_CONNECTIONS", 10)),
+        tcp_keepalive=os.environ.get("BOTO_TCP_KEEPALIVE", "true").lower() == "true",
+        retries={
+            "mode": os.environ.get("BOTO_RETRY_MODE", "standard"),
+            # Total attempts, including the first call, as in AWS_MAX_ATTEMPTS.
+            "total_max_attempts": int(os.environ.get("BOTO_MAX_ATTEMPTS", 3)),
+        },
+    )
+    if BOTOCORE_SESSION:
+        BOTOCORE_SESSION.set_default_client_config(CLIENT_CONFIG)
+    return CLIENT_CONFIG
+
+
+def new_base_session(data_loader=None):
+    """Replace the shared session, optionally keeping a warm data loader."""
+    global BOTOCORE_SESSION, SESSION  # pylint: disable=global-statement
+    # The assume-role credential fetchers create their STS clients from this
+    # session, so it must tolerate being used by concurrent rollbacks.
+    BOTOCORE_SESSION = ThreadSafeSession()
+    if data_loader:
+        BOTOCORE_SESSION.register_component("data_loader", data_loader)
+
+    # Use the STS endpoint in the function's region rather than the global
+    # endpoint, and apply the shared config to clients created internally,
+    # such as the STS client used by assume_role().
+    BOTOCORE_SESSION.set_config_variable(
+        "sts_regional_endpoints", os.environ.get("STS_REGIONAL_ENDPOINTS", "regional")
+    )
+    BOTOCORE_SESSION.set_default_client_config(CLIENT_CONFIG or new_client_config())
+
+    SESSION = boto3.session.Session(botocore_session=BOTOCORE_SESSION)
+    return SESSION
+
+
+def get_base_session():
+    """Return the shared boto3 session, creating it on first use."""
+    return SESSION or new_base_session()
+
+
+def get_client(session, service):
+    """Return a client for the service using the shared botocore config."""
+    return session.client(service, config=CLIENT_CONFIG or new_client_config())
+
+
 def get_session(assume_role_arn):
     """Return boto3 session established using a role arn or AWS profile."""
     if not assume_role_arn:
-        return boto3.session.Session()
+        return get_base_session()
 
     function_name = os.environ.get(
         "AWS_LAMBDA_FUNCTION_NAME", os.path.basename(__file__)
@@ -86,15 +192,185 @@ def get_session(assume_role_arn):
         }
     )
 
-    return assume_role(
-        boto3.Session(),
+    session = assume_role(
+        get_base_session(),
         assume_role_arn,
         RoleSessionName=generate_lambda_session_name(function_name),
         validate=False,
     )
 
+    # assume_role() builds a new botocore session with a cold data loader;
+    # share the primed one so clients on the assumed session load quickly.
+    session._session.register_component(  # pylint: disable=protected-access
+        "data_loader", BOTOCORE_SESSION.get_component("data_loader")
+    )
+    return session
+
+
+# ---------------------------------------------------------------------
+# Snapshots of previous trust policies, stored by content hash either in
+# a local directory or under an S3 prefix ("s3://bucket/prefix").
+
+
+def get_policy_digest(document):
+    """Return the SHA-256 hash of a trust policy document."""
+    canonical = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def parse_s3_location(location, digest):
+    """Return the S3 bucket and key of a snapshot, or None if not S3."""
+    if not location.startswith("s3://"):
+        return None
+    bucket, _, prefix = location[len("s3://") :].partition("/")
+    prefix = prefix.strip("/")
+    return bucket, f"{prefix}/{digest}.json" if prefix else f"{digest}.json"
+
+
+def save_snapshot(location, document):
+    """Store a trust policy document and return its hash."""
+    digest = get_policy_digest(document)
+    body = json.dumps(document)
 
-def main(role_arn, role_name, trust_policy):
+    s3_location = parse_s3_location(location, digest)
+    if s3_location:
+        bucket, key = s3_location
+        get_client(get_base_session(), "s3").put_object(
+            Bucket=bucket, Key=key, Body=body.encode("utf-8")
+        )
+    else:
+        os.makedirs(location, exist_ok=True)
+        with open(
+            os.path.join(location, f"{digest}.json"), "w", encoding="utf-8"
+        ) as snapshot:
+            snapshot.write(body)
+    return digest
+
+
+def load_snapshot(location, digest):
+    """Return the trust policy document stored under a hash."""
+    s3_location = parse_s3_location(location, digest)
+    if s3_location:
+        bucket, key = s3_location
+        s3_client = get_client(get_base_session(), "s3")
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        document = json.loads(response["Body"].read())
+    else:
+        with open(
+            os.path.join(location, f"{digest}.json"), encoding="utf-8"
+        ) as snapshot:
+            document = json.load(snapshot)
+
+    if get_policy_digest(document) != digest:
+        raise TrustPolicyRollbackError(
+            f"Snapshot {digest} in {location} does not match its hash"
+        )
+    return document
+
+
+def snapshot_trust_policy(iam_client, role_arn, role_name, location):
+    """Record the current trust policy of a role before it is replaced."""
+    document = iam_client.get_role(RoleName=role_name)["Role"][
+        "AssumeRolePolicyDocument"
+    ]
+    digest = save_snapshot(location, document)
+    LOG.info(
+        {
+            "comment": f"Saved previous trust policy of IAM role ({role_name})",
+            "role_arn": role_arn,
+            "role_name": role_name,
+            "snapshot_location": location,
+            "snapshot_digest": digest,
+        }
+    )
+    return digest
+
+
+def rollback_account(role_arn, role_name, document, digest):
+    """Restore a trust policy in one account, unless it is already applied."""
+    # Only building the session touches the shared parent session; the
+    # role is assumed on the first IAM call, outside the lock.
+    with SESSION_LOCK:
+        session = get_session(role_arn)
+    iam_client = get_client(session, "iam")
+
+    current = iam_client.get_role(RoleName=role_name)["Role"][
+        "AssumeRolePolicyDocument"
+    ]
+    if get_policy_digest(current) == digest:
+        LOG.info(
+            {
+                "comment": f"IAM role ({role_name}) already matches snapshot",
+                "role_arn": role_arn,
+                "snapshot_digest": digest,
+            }
+        )
+        return False
+
+    LOG.info(
+        {
+            "comment": f"Restoring trust policy of IAM role ({role_name})",
+            "role_arn": role_arn,
+            "snapshot_digest": digest,
+        }
+    )
+    iam_client.update_assume_role_policy(
+        RoleName=role_name, PolicyDocument=json.dumps(document)
+    )
+    return True
+
+
+def rollback(role_arns, role_name, digest, snapshot_location, max_workers=10):
+    """Restore a trust policy snapshot across many accounts concurrently."""
+    document = load_snapshot(snapshot_location, digest)
+
+    restored, skipped, failed = [], [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(rollback_account, role_arn, role_name, document, digest): (
+                role_arn
+            )
+            for role_arn in set(role_arns)
+        }
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    restored.append(futures[future])
+                else:
+                    skipped.append(futures[future])
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                LOG.exception(
+                    {
+                        "comment": f"Failed to restore trust policy: {exc}",
+                        "role_arn": futures[future],
+                        "snapshot_digest": digest,
+                    }
+                )
+                failed.append(futures[future])
+
+    LOG.info(
+        {
+            "comment": (
+                f"Restored snapshot in {len(restored)} account(s), skipped "
+                f"{len(skipped)}, failed {len(failed)}"
+            ),
+            "snapshot_digest": digest,
+            "restored": sorted(restored),
+            "skipped": sorted(skipped),
+            "failed": sorted(failed),
+        }
+    )
+    if failed:
+        raise TrustPolicyRollbackError(
+            f"Failed to restore snapshot {digest} for: {', '.join(sorted(failed))}"
+        )
+    return {"restored": sorted(restored), "skipped": sorted(skipped)}
+
+
+# ---------------------------------------------------------------------
+
+
+def main(role_arn, role_name, trust_policy, snapshot_location=None):
     """Assume role and update role trust policy."""
     # Validate trust policy contains properly formatted JSON.  This is
     # not a validation against a schema, so the JSON could still be bad.
@@ -102,6 +378,11 @@ def main(role_arn, role_name, trust_policy):
 
     # Create a session using an assumed role in the new account.
     session = get_session(role_arn)
+    iam_client = get_client(session, "iam")
+
+    # Record the trust policy being replaced, so it can be rolled back.
+    if snapshot_location:
+        snapshot_trust_policy(iam_client, role_arn, role_name, snapshot_location)
 
     # Update the role trust policy.
     LOG.info(
@@ -111,7 +392,6 @@ def main(role_arn, role_name, trust_policy):
             "trust_policy": trust_policy,
         }
     )
-    iam_client = session.client("iam")
     iam_client.update_assume_role_policy(
         RoleName=role_name, PolicyDocument=trust_policy
     )
@@ -144,6 +424,37 @@ def check_for_null_envvars(assume_role_name, update_role_name, trust_policy):
         raise TrustPolicyInvalidArgumentsError(errmsg)
 
 
+def prime():
+    """Warm imports, clients and endpoints before a SnapStart snapshot."""
+    trust_policy = os.environ.get("TRUST_POLICY")
+    if trust_policy:
+        json.loads(trust_policy)
+
+    # Creating the clients loads the service models and endpoint rulesets
+    # into the session's data loader, which is kept across restores.
+    session = get_base_session()
+    for service in ("sts", "iam"):
+        client = get_client(session, service)
+        LOG.debug(
+            {
+                "comment": f"Primed {service} client",
+                "endpoint_url": client.meta.endpoint_url,
+            }
+        )
+
+
+def refresh_after_restore():
+    """Discard state that must not be shared by restored environments."""
+    # Restored environments start from identical memory, so reseed the
+    # generator used by generate_lambda_session_name for random names.
+    random.seed()
+
+    data_loader = None
+    if BOTOCORE_SESSION:
+        data_loader = BOTOCORE_SESSION.get_component("data_loader")
+    new_base_session(data_loader)
+
+
 @LOG.inject_lambda_context(log_event=True)
 def lambda_handler(event, context):  # pylint: disable=unused-argument
     """Entry point for the lambda handler."""
@@ -169,12 +480,22 @@ def lambda_handler(event, context):  # pylint: disable=unused-argument
     role_arn = f"arn:{partition}:iam::{account_id}:role/{assume_role_name}"
 
     # Assume the role and update the role trust policy.
-    main(role_arn, update_role_name, trust_policy)
+    main(
+        role_arn,
+        update_role_name,
+        trust_policy,
+        snapshot_location=os.environ.get("SNAPSHOT_LOCATION"),
+    )
 
 
 # Configure exception handler
 sys.excepthook = exception_hook
 
+# Register SnapStart runtime hooks; these only fire when SnapStart is enabled.
+if register_before_snapshot:
+    register_before_snapshot(prime)
+    register_after_restore(refresh_after_restore)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Update a role trust policy in another account."
@@ -182,18 +503,61 @@ if __name__ == "__main__":
     parser.add_argument(
         "--role-arn",
         required=True,
-        help="ARN of the IAM role to assume in the target account (case sensitive)",
+        nargs="+",
+        help=(
+            "ARN of the IAM role to assume in the target account (case "
+            "sensitive); --rollback accepts one ARN per target account"
+        ),
     )
     parser.add_argument(
         "--role-name",
         required=True,
         help="Name of the IAM role to update in the target account (case sensitive)",
     )
-    parser.add_argument(
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument(
         "--trust-policy",
-        required=True,
         help="Trust policy to apply to the role in the target account",
     )
+    action.add_argument(
+        "--rollback",
+        metavar="DIGEST",
+        help="Hash of a saved trust policy snapshot to restore in every account",
+    )
+    parser.add_argument(
+        "--snapshot-location",
+        help=(
+            "Local directory or s3://bucket/prefix used to save the previous "
+            "trust policy before an update, and to read snapshots for --rollback"
+        ),
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=10,
+        help="Number of accounts to roll back concurrently",
+    )
 
     args = parser.parse_args()
-    sys.exit(main(**vars(args)))
+    if args.rollback:
+        if not args.snapshot_location:
+            parser.error("--rollback requires --snapshot-location")
+        rollback(
+            args.role_arn,
+            args.role_name,
+            args.rollback,
+            args.snapshot_location,
+            max_workers=args.max_workers,
+        )
+        sys.exit()
+
+    if len(args.role_arn) > 1:
+        parser.error("--trust-policy accepts a single --role-arn")
+    sys.exit(
+        main(
+            args.role_arn[0],
+            args.role_name,
+            args.trust_policy,
+            snapshot_location=args.snapshot_location,
+        )
+    )
@@ -429,3 +429,268 @@ def test_lambda_handler_missing_trust_policy(
         "Environment variable 'TRUST_POLICY' must be a JSON-formatted string "
         "containing the role trust policy."
     ) in str(exc.value)
+
+
+def test_prime_invalid_trust_policy(monkeypatch):
+    """Invoke prime() with a trust policy that is not valid JSON."""
+    monkeypatch.setenv("TRUST_POLICY", '{"Version": "2012-10-17"')
+
+    with pytest.raises(json.decoder.JSONDecodeError):
+        lambda_func.prime()
+
+
+def test_refresh_after_restore(aws_credentials, monkeypatch, replacement_trust_policy):
+    """Verify the shared session is replaced but its data loader is kept."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("TRUST_POLICY", replacement_trust_policy)
+    lambda_func.prime()
+    primed_session = lambda_func.get_base_session()
+    data_loader = lambda_func.BOTOCORE_SESSION.get_component("data_loader")
+
+    seeds = []
+    monkeypatch.setattr(lambda_func.random, "seed", lambda *args: seeds.append(args))
+
+    lambda_func.refresh_after_restore()
+
+    assert lambda_func.get_base_session() is not primed_session
+    assert lambda_func.BOTOCORE_SESSION.get_component("data_loader") is data_loader
+    assert seeds == [()]
+
+
+def test_assumed_session_shares_primed_loader(
+    aws_credentials, monkeypatch, replacement_trust_policy
+):
+    """Verify sessions from get_session() reuse the primed data loader."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("TRUST_POLICY", replacement_trust_policy)
+    lambda_func.prime()
+    data_loader = lambda_func.BOTOCORE_SESSION.get_component("data_loader")
+
+    session = lambda_func.get_session(f"arn:aws:iam::{ACCOUNT_ID}:role/test")
+
+    # pylint: disable=protected-access
+    assert session._session.get_component("data_loader") is data_loader
+
+
+def test_main_func_saves_snapshot(
+    tmpdir,
+    sts_client,
+    iam_client,
+    mock_event,
+    initial_trust_policy,
+    replacement_trust_policy,
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Verify main() saves the replaced trust policy before updating it."""
+    assume_role_name = "TEST_TRUST_POLICY_SNAPSHOT_ASSUME_ROLE"
+    update_role_name = "TEST_TRUST_POLICY_SNAPSHOT_UPDATE_ROLE"
+    snapshot_location = str(tmpdir.join("snapshots"))
+
+    new_account_id = lambda_func.get_account_id(mock_event)
+    sts_response = sts_client.assume_role(
+        RoleArn=f"arn:aws:iam::{new_account_id}:role/OrganizationAccountAccessRole",
+        RoleSessionName="test-session-name",
+        ExternalId="test-external-id",
+    )
+    new_iam_client = boto3.client(
+        "iam",
+        aws_access_key_id=sts_response["Credentials"]["AccessKeyId"],
+        aws_secret_access_key=sts_response["Credentials"]["SecretAccessKey"],
+        aws_session_token=sts_response["Credentials"]["SessionToken"],
+        region_name=AWS_REGION,
+    )
+
+    create_roles(
+        new_iam_client, initial_trust_policy, [assume_role_name, update_role_name]
+    )
+
+    lambda_func.main(
+        role_arn=f"arn:aws:iam::{new_account_id}:role/{assume_role_name}",
+        role_name=update_role_name,
+        trust_policy=replacement_trust_policy,
+        snapshot_location=snapshot_location,
+    )
+
+    digest = lambda_func.get_policy_digest(json.loads(initial_trust_policy))
+    snapshot = lambda_func.load_snapshot(snapshot_location, digest)
+    assert json.dumps(snapshot) == initial_trust_policy
+
+
+def test_rollback_restores_snapshot(
+    tmpdir,
+    sts_client,
+    iam_client,
+    org_client,
+    mock_event,
+    initial_trust_policy,
+    replacement_trust_policy,
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    """Verify rollback() restores a snapshot and skips roles already restored."""
+    assume_role_name = "TEST_TRUST_POLICY_ROLLBACK_ASSUME_ROLE"
+    update_role_name = "TEST_TRUST_POLICY_ROLLBACK_UPDATE_ROLE"
+    snapshot_location = str(tmpdir.join("snapshots"))
+
+    # Create a second account, whose role keeps its initial trust policy.
+    car_id = org_client.create_account(
+        AccountName=f"{MOCK_ORG_NAME}_2", Email=f"2_{MOCK_ORG_EMAIL}"
+    )["CreateAccountStatus"]["Id"]
+    account_ids = [
+        lambda_func.get_account_id(mock_event),
+        org_client.describe_create_account_status(CreateAccountRequestId=car_id)[
+            "CreateAccountStatus"
+        ]["AccountId"],
+    ]
+
+    iam_clients = []
+    for account_id in account_ids:
+        sts_response = sts_client.assume_role(
+            RoleArn=f"arn:aws:iam::{account_id}:role/OrganizationAccountAccessRole",
+            RoleSessionName="test-session-name",
+            ExternalId="test-external-id",
+        )
+        new_iam_client = boto3.client(
+            "iam",
+            aws_access_key_id=sts_response["Credentials"]["AccessKeyId"],
+            aws_secret_access_key=sts_response["Credentials"]["SecretAccessKey"],
+            aws_session_token=sts_response["Credentials"]["SessionToken"],
+            region_name=AWS_REGION,
+        )
+        create_roles(
+            new_iam_client, initial_trust_policy, [assume_role_name, update_role_name]
+        )
+        iam_clients.append(new_iam_client)
+
+    role_arns = [
+        f"arn:aws:iam::{account_id}:role/{assume_role_name}"
+        for account_id in account_ids
+    ]
+    lambda_func.main(
+        role_arn=role_arns[0],
+        role_name=update_role_name,
+        trust_policy=replacement_trust_policy,
+        snapshot_location=snapshot_location,
+    )
+    digest = lambda_func.get_policy_digest(json.loads(initial_trust_policy))
+
+    assert lambda_func.rollback(
+        role_arns, update_role_name, digest, snapshot_location
+    ) == {"restored": [role_arns[0]], "skipped": [role_arns[1]]}
+    for new_iam_client in iam_clients:
+        role_info = new_iam_client.get_role(RoleName=update_role_name)
+        update_policy = json.dumps(role_info["Role"]["AssumeRolePolicyDocument"])
+        assert update_policy == initial_trust_policy
+
+    # Every role is now at the snapshot, so a second rollback is a no-op.
+    assert lambda_func.rollback(
+        role_arns, update_role_name, digest, snapshot_location
+    ) == {"restored": [], "skipped": sorted(role_arns)}
+
+
+def test_rollback_missing_role(
+    tmpdir, sts_client, iam_client, mock_event, initial_trust_policy
+):
+    """Verify rollback() reports accounts where the restore failed."""
+    snapshot_location = str(tmpdir.join("snapshots"))
+    digest = lambda_func.save_snapshot(
+        snapshot_location, json.loads(initial_trust_policy)
+    )
+    new_account_id = lambda_func.get_account_id(mock_event)
+    role_arn = f"arn:aws:iam::{new_account_id}:role/OrganizationAccountAccessRole"
+
+    with pytest.raises(lambda_func.TrustPolicyRollbackError) as exc:
+        lambda_func.rollback(
+            [role_arn], "TEST_ROLE_DOES_NOT_EXIST", digest, snapshot_location
+        )
+    assert role_arn in str(exc.value)
+
+
+def test_client_config_from_environment(monkeypatch):
+    """Verify the shared client config is tuned by environment variables."""
+    monkeypatch.setenv("BOTO_CONNECT_TIMEOUT", "2")
+    monkeypatch.setenv("BOTO_READ_TIMEOUT", "10")
+    monkeypatch.setenv("BOTO_TCP_KEEPALIVE", "false")
+    monkeypatch.setenv("BOTO_RETRY_MODE", "adaptive")
+    monkeypatch.setenv("BOTO_MAX_ATTEMPTS", "5")
+    monkeypatch.setenv("BOTO_MAX_POOL_CONNECTIONS", "25")
+
+    config = lambda_func.new_client_config()
+
+    # botocore sets the Config attributes dynamically.
+    # pylint: disable=no-member
+    assert config.connect_timeout == 2
+    assert config.read_timeout == 10
+    assert config.max_pool_connections == 25
+    assert not config.tcp_keepalive
+    assert config.retries == {"mode": "adaptive", "total_max_attempts": 5}
+
+    # Restore the defaults for the remaining tests.
+    monkeypatch.undo()
+    lambda_func.new_client_config()
+
+
+def test_get_client_uses_shared_config(aws_credentials, monkeypatch):
+    """Verify clients use the shared config and regional STS endpoint."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-west-2")
+    lambda_func.new_base_session()
+
+    sts = lambda_func.get_client(lambda_func.get_base_session(), "sts")
+
+    # botocore sets the Config attributes dynamically.
+    # pylint: disable=no-member
+    assert sts.meta.config.max_pool_connections == (
+        lambda_func.CLIENT_CONFIG.max_pool_connections
+    )
+    assert sts.meta.config.retries["total_max_attempts"] == 3
+    assert sts.meta.endpoint_url == "https://sts.us-west-2.amazonaws.com"
+
+
+@pytest.mark.parametrize(
+    "invited_party",
+    [
+        {"type": "ACCOUNT", "id": "222222222222"},
+        {"type": "EMAIL", "id": "invited@example.com"},
+    ],
+)
+def test_get_account_id_accept_handshake(invited_party):
+    """Verify the invited account id is read from an accepted handshake."""
+    invited_account_id = "222222222222"
+    event = {
+        "detail-type": "AWS API Call via CloudTrail",
+        "source": "aws.organizations",
+        "detail": {
+            "eventName": "AcceptHandshake",
+            "eventSource": "organizations.amazonaws.com",
+            "recipientAccountId": invited_account_id,
+            "userIdentity": {"accountId": invited_account_id},
+            "requestParameters": {"handshakeId": "h-examplehandshakeid111"},
+            "responseElements": {
+                "handshake": {
+                    "action": "INVITE",
+                    "state": "ACCEPTED",
+                    "parties": [
+                        {"type": "ORGANIZATION", "id": "exampleorgid"},
+                        invited_party,
+                    ],
+                }
+            },
+        },
+    }
+
+    assert lambda_func.get_account_id(event) == invited_account_id
+
+
+def test_get_account_id_accept_handshake_without_account():
+    """Verify a handshake with no account id raises a clear KeyError."""
+    event = {
+        "detail": {
+            "eventName": "AcceptHandshake",
+            "responseElements": {
+                "handshake": {
+                    "parties": [{"type": "ORGANIZATION", "id": "exampleorgid"}],
+                }
+            },
+        },
+    }
+
+    with pytest.raises(KeyError) as exc:
+        lambda_func.get_account_id(event)
+    assert "No ACCOUNT party in handshake parties" in str(exc.value)
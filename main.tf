@@ -14,6 +14,20 @@ data "aws_iam_policy_document" "lambda" {
       "arn:${data.aws_partition.current.partition}:iam::*:role/${var.assume_role_name}",
     ]
   }
+
+  dynamic "statement" {
+    for_each = var.snapshot_location != null ? [trimsuffix(trimprefix(var.snapshot_location, "s3://"), "/")] : []
+
+    content {
+      actions = [
+        "s3:PutObject"
+      ]
+
+      resources = [
+        "arn:${data.aws_partition.current.partition}:s3:::${statement.value}/*",
+      ]
+    }
+  }
 }
 
 resource "random_string" "id" {
@@ -54,11 +68,25 @@ module "lambda" {
   s3_prefix                = var.lambda.s3_prefix
   store_on_s3              = var.lambda.store_on_s3
 
+  # SnapStart applies only to published versions, so publish one whenever
+  # it is enabled and point the event targets at that version.
+  publish    = var.lambda.snap_start
+  snap_start = var.lambda.snap_start
+
   environment_variables = {
-    ASSUME_ROLE_NAME = var.assume_role_name
-    UPDATE_ROLE_NAME = var.update_role_name
-    TRUST_POLICY     = var.trust_policy
-    LOG_LEVEL        = var.log_level
+    ASSUME_ROLE_NAME  = var.assume_role_name
+    UPDATE_ROLE_NAME  = var.update_role_name
+    TRUST_POLICY      = var.trust_policy
+    LOG_LEVEL         = var.log_level
+    SNAPSHOT_LOCATION = var.snapshot_location
+
+    BOTO_CONNECT_TIMEOUT      = var.lambda.botocore_config.connect_timeout
+    BOTO_MAX_ATTEMPTS         = var.lambda.botocore_config.max_attempts
+    BOTO_MAX_POOL_CONNECTIONS = var.lambda.botocore_config.max_pool_connections
+    BOTO_READ_TIMEOUT         = var.lambda.botocore_config.read_timeout
+    BOTO_RETRY_MODE           = var.lambda.botocore_config.retry_mode
+    BOTO_TCP_KEEPALIVE        = var.lambda.botocore_config.tcp_keepalive
+    STS_REGIONAL_ENDPOINTS    = var.lambda.botocore_config.sts_regional_endpoints
   }
 }
 
@@ -82,6 +110,22 @@ locals {
         "detail" : {
           "eventSource" : ["organizations.amazonaws.com"],
           "eventName" : ["InviteAccountToOrganization"]
+          "errorCode" : [{ "exists" : false }]
+        }
+      }
+    )
+    AcceptHandshake = jsonencode(
+      {
+        "detail" : {
+          "eventSource" : ["organizations.amazonaws.com"],
+          "eventName" : ["AcceptHandshake"]
+          "errorCode" : [{ "exists" : false }]
+          "responseElements" : {
+            "handshake" : {
+              "action" : ["INVITE"]
+              "state" : ["ACCEPTED"]
+            }
+          }
         }
       }
     )
@@ -101,7 +145,7 @@ resource "aws_cloudwatch_event_target" "this" {
   for_each = aws_cloudwatch_event_rule.this
 
   rule = each.value.name
-  arn  = module.lambda.lambda_function_arn
+  arn  = var.lambda.snap_start ? module.lambda.lambda_function_qualified_arn : module.lambda.lambda_function_arn
 }
 
 resource "aws_lambda_permission" "events" {
@@ -109,6 +153,7 @@ resource "aws_lambda_permission" "events" {
 
   action        = "lambda:InvokeFunction"
   function_name = module.lambda.lambda_function_name
+  qualifier     = var.lambda.snap_start ? module.lambda.lambda_function_version : null
   principal     = "events.amazonaws.com"
   source_arn    = each.value.arn
 }
@@ -22,15 +22,24 @@ variable "event_types" {
   ]
 
   validation {
-    condition     = alltrue([for event in var.event_types : contains(["CreateAccountResult", "InviteAccountToOrganization"], event)])
-    error_message = "Supported event_types include only: CreateAccountResult, InviteAccountToOrganization"
+    condition     = alltrue([for event in var.event_types : contains(["AcceptHandshake", "CreateAccountResult", "InviteAccountToOrganization"], event)])
+    error_message = "Supported event_types include only: AcceptHandshake, CreateAccountResult, InviteAccountToOrganization"
   }
 }
 
 variable "lambda" {
   description = "Map of any additional arguments for the upstream lambda module. See <https://github.com/terraform-aws-modules/terraform-aws-lambda>"
   type = object({
-    artifacts_dir            = optional(string, "builds")
+    artifacts_dir = optional(string, "builds")
+    botocore_config = optional(object({
+      connect_timeout        = optional(number, 5)
+      max_attempts           = optional(number, 3)
+      max_pool_connections   = optional(number, 10)
+      read_timeout           = optional(number, 30)
+      retry_mode             = optional(string, "standard")
+      sts_regional_endpoints = optional(string, "regional")
+      tcp_keepalive          = optional(bool, true)
+    }), {})
     create_package           = optional(bool, true)
     ephemeral_storage_size   = optional(number)
     ignore_source_code_hash  = optional(bool, true)
@@ -40,9 +49,20 @@ variable "lambda" {
     s3_bucket                = optional(string)
     s3_existing_package      = optional(map(string))
     s3_prefix                = optional(string)
+    snap_start               = optional(bool, false)
     store_on_s3              = optional(bool, false)
   })
   default = {}
+
+  validation {
+    condition     = contains(["legacy", "standard", "adaptive"], var.lambda.botocore_config.retry_mode)
+    error_message = "Supported lambda.botocore_config.retry_mode values include only: legacy, standard, adaptive"
+  }
+
+  validation {
+    condition     = contains(["regional", "legacy"], var.lambda.botocore_config.sts_regional_endpoints)
+    error_message = "Supported lambda.botocore_config.sts_regional_endpoints values include only: regional, legacy"
+  }
 }
 
 variable "log_level" {
@@ -51,6 +71,17 @@ variable "log_level" {
   type        = string
 }
 
+variable "snapshot_location" {
+  default     = null
+  description = "S3 location (s3://bucket/prefix) where the previous trust policy of each role is saved before it is updated"
+  type        = string
+
+  validation {
+    condition     = var.snapshot_location == null || can(regex("^s3://[^/]+", var.snapshot_location))
+    error_message = "The snapshot_location must be an S3 URI of the form s3://bucket/prefix"
+  }
+}
+
 variable "tags" {
   default     = {}
   description = "Tags that are passed to resources"